@@ -1,5 +1,7 @@
 import numpy as np
 from scipy.ndimage import gaussian_filter1d
+from scipy.optimize import linear_sum_assignment
+from scipy.signal import find_peaks
 
 
 class ResultAnalyzer:
@@ -10,3 +12,142 @@ class ResultAnalyzer:
             y1, y2, y3 = p[i-1], p[i], p[i+1]
             return i + 0.5 * (y1 - y3) / (y1 - 2*y2 + y3 + 1e-10)
         return float(i)
+
+    def get_interface_rows(self, edge_map, k=3, prominence=0.1, min_separation=5):
+        """
+        Top-k sub-pixel interface rows from one edge map, sorted top to bottom.
+
+        prominence     : minimum peak prominence relative to the profile range
+        min_separation : minimum distance between interfaces in rows
+        """
+        p = gaussian_filter1d(np.mean(edge_map, 1), 1.0)
+        span = p.max() - p.min()
+        if span <= 0:
+            return np.empty(0)
+
+        # find_peaks never returns the end points, so i-1 / i+1 are always valid
+        peaks, props = find_peaks(p, prominence=prominence * span, distance=max(1, min_separation))
+        if len(peaks) == 0:
+            return np.empty(0)
+
+        i = peaks[np.argsort(props["prominences"])[::-1][:k]]
+        y1, y2, y3 = p[i-1], p[i], p[i+1]
+        rows = i + 0.5 * (y1 - y3) / (y1 - 2*y2 + y3 + 1e-10)
+        return np.sort(rows)
+
+    def get_column_fit(self, edge_map, strips=8, degree=1):
+        """
+        Tilt-robust level: sub-pixel peak per column strip, then a robust
+        polynomial fit through the strip peaks (line for degree=1, curved
+        meniscus for degree=2).
+
+        Returns the level row at the centre column, the tilt in degrees and
+        the RMS fit residual in rows.
+        """
+        h, w = edge_map.shape
+        strips = max(1, min(strips, w))
+        sw = w // strips
+
+        # Profile per strip, all strips at once
+        p = edge_map[:, :sw * strips].reshape(h, strips, sw).mean(axis=2)
+        p = gaussian_filter1d(p, 1.0, axis=0)
+
+        j = np.arange(strips)
+        i = np.argmax(p, axis=0)
+        rows = i.astype(float)
+        # Edge peaks (and maps under 3 rows) have no neighbours - keep the integer row
+        inner = (i > 0) & (i < h - 1)
+        if inner.any():
+            ii, jj = i[inner], j[inner]
+            y1, y2, y3 = p[ii-1, jj], p[ii, jj], p[ii+1, jj]
+            rows[inner] = ii + 0.5 * (y1 - y3) / (y1 - 2*y2 + y3 + 1e-10)
+
+        x = (j + 0.5) * sw
+        deg = min(degree, strips - 1)
+
+        # Robust start: Theil-Sen line (median of pairwise slopes)
+        if deg > 0:
+            dx = x[None, :] - x[:, None]
+            upper = dx > 0
+            slope = np.median((rows[None, :] - rows[:, None])[upper] / dx[upper])
+            coef = np.zeros(deg + 1)
+            coef[-2:] = slope, np.median(rows - slope * x)
+        else:
+            coef = np.array([np.median(rows)])
+
+        # Tukey bisquare reweighting; strips with a clearer peak count more
+        contrast = np.clip(p[i, j] - p.mean(axis=0), 1e-6, None)
+        contrast = contrast / contrast.max()
+        for _ in range(3):
+            res = rows - np.polyval(coef, x)
+            scale = 1.4826 * np.median(np.abs(res)) + 0.5
+            u = np.clip(res / (4.685 * scale), -1.0, 1.0)
+            wts = contrast * (1.0 - u ** 2) ** 2 + 1e-12
+            coef = np.polyfit(x, rows, deg, w=np.sqrt(wts))
+        res = rows - np.polyval(coef, x)
+
+        center = w / 2.0
+        slope = np.polyval(np.polyder(coef), center) if deg > 0 else 0.0
+        return {
+            "row": float(np.polyval(coef, center)),
+            "tilt_deg": float(np.degrees(np.arctan(slope))),
+            "residual": float(np.sqrt(np.sum(wts * res ** 2) / np.sum(wts)))
+        }
+
+
+class InterfaceTracker:
+    """
+    Keeps a stable id per interface across frames.
+
+    New rows are matched to the last known rows with a minimum-cost
+    assignment; matches further than max_jump rows apart are rejected.
+    An interface missing for more than max_missed frames frees its id; the
+    ids freed by the last update() are listed in `released`, so per-id state
+    (zero reference, calibration) can be dropped before a new interface
+    takes the slot.
+    """
+
+    def __init__(self, num_interfaces=2, max_jump=15.0, max_missed=10):
+        self.num_interfaces = num_interfaces
+        self.max_jump = max_jump
+        self.max_missed = max_missed
+        self.reset()
+
+    def reset(self):
+        self._known = [None] * self.num_interfaces
+        self._missed = [0] * self.num_interfaces
+        self.released = []
+
+    def update(self, rows):
+        """Return the row per interface id for this frame (None when not found)"""
+        rows = [float(r) for r in rows]
+        current = [None] * self.num_interfaces
+        self.released = []
+
+        tracked = [i for i, r in enumerate(self._known) if r is not None]
+        used = set()
+        if tracked and rows:
+            cost = np.abs(
+                np.array([self._known[i] for i in tracked])[:, None] - np.array(rows)[None, :]
+            )
+            for t, j in zip(*linear_sum_assignment(cost)):
+                if cost[t, j] <= self.max_jump:
+                    current[tracked[t]] = rows[j]
+                    used.add(j)
+
+        # Unmatched rows start (or restart) free slots, top to bottom
+        free = [i for i in range(self.num_interfaces) if self._known[i] is None]
+        for j, r in enumerate(rows):
+            if j not in used and free:
+                current[free.pop(0)] = r
+
+        for i, r in enumerate(current):
+            if r is not None:
+                self._known[i] = r
+                self._missed[i] = 0
+            elif self._known[i] is not None:
+                self._missed[i] += 1
+                if self._missed[i] > self.max_missed:
+                    self._known[i] = None
+                    self.released.append(i)
+        return current
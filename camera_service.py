@@ -9,37 +9,72 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 print("Importing detector...")
-from detector import PMI_Edge_Detector
+from detector import DETECTORS, create_detector
 print("Importing analyzer...")
-from analyzer import ResultAnalyzer
+from analyzer import ResultAnalyzer, InterfaceTracker
+from history_store import HistoryStore, history_path, query_history
+from roi_tracker import AutoROI
+from shadow import ShadowRunner
+from checkpoint import CHECKPOINT_FILE, write_checkpoint, load_checkpoint
+from storage import StorageManager
+from stats import StatsSnapshot, EMPTY_STATS, RateEstimator
 print("Imports complete in camera_service.")
 
 
+# Session lifecycle states
+IDLE = "idle"
+STARTING = "starting"
+RUNNING = "running"
+DRAINING = "draining"   # stop requested - workers finish pending saves and the report
+
+
 class CameraService:
     def __init__(self):
         print("Initializing CameraService...")
-        self.running = False
+        self.state = IDLE
+        self._lifecycle_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._capture_thread = None
+        self._processing_thread = None
         self.cap = None
         self.latest_frame = None        # Frame with UI overlay (for video feed)
         self.latest_frame_process = None # Clean frame (for analysis)
+        self._frame_seq = 0              # Incremented for every captured frame
         self.frame_lock = threading.Lock()
-        self.current_level = 0.0
+        self._frame_time = 0.0           # Capture time of latest_frame_process
         self.ref_row = None
         self._last_row = None
         self.data_results = []
         self.calibration = 1.0
         self.save_dir = "session_output"
         self.frame_count = 0
-        self.current_fps = 0.0
-        self.current_processing_time = 0.0
         self.target_fps = 120.0  # Boost default to 120 FPS
-        self._fps_window = []
-        
+
+        # Live stats - an immutable snapshot swapped in after every frame
+        self._stats = EMPTY_STATS
+        self._rate = RateEstimator()
+
         # Async Save Queue - No maxsize limit to prevent frame drops
         self.save_queue = queue.Queue()
         self.dropped_frames = 0
         threading.Thread(target=self._save_loop, daemon=True).start()
 
+        # Persistent per-session history (SQLite, batched writes)
+        self.history = HistoryStore()
+
+        # Disk budget + background compaction of session folders (started by the server)
+        self.storage = StorageManager()
+
+        # Crash-safe checkpoint of config + measurement state (results live in the history DB)
+        self.checkpoint_path = CHECKPOINT_FILE
+        self.checkpoint_interval = 2.0   # seconds between periodic checkpoints
+        self._checkpoint_lock = threading.Lock()
+        self._last_checkpoint = 0.0
+        self._resumed = False
+        self._restoring = False          # resume() is applying a checkpoint - do not write one
+        self.source = None
+        self._capture_pos = 0            # frames read from the source (used to seek video files on resume)
+
 
         # ROI (Region of Interest) - None means full frame
         self.roi = None  # Format: (x1, y1, x2, y2)
@@ -49,12 +84,51 @@ class CameraService:
         self.clahe_clip_limit = 2.0
         self.clahe_tile_grid_size = (8, 8)
 
+        # Motion Gate Settings - skip detection when the ROI is unchanged
+        self.motion_gate_enabled = True
+        self.motion_threshold = 4.0      # Largest abs diff (grey levels) between ROI thumbnail cells
+        self.max_carry_forward = 30      # Force a full detection after this many skips
+        self.carried_frames = 0
+        self._last_signature = None
+        self._carry_streak = 0
+        self._gate_generation = 0        # Bumped when settings change what detection would return
+        self._last_img_path = None
+
+        # Automatic ROI - tight crop around vessel / meniscus inside the user ROI
+        self.auto_roi_enabled = False
+        self.auto_roi = AutoROI()
+
+        # Multi-Interface Detection - 1 means single level only
+        self.num_interfaces = 1
+        self.interface_prominence = 0.1
+        self.interface_min_separation = 5
+        self.interface_tracker = InterfaceTracker(num_interfaces=1)
+        self.interface_refs = {}          # interface id -> reference row
+        self.interface_calibrations = {}  # interface id -> calibration (falls back to self.calibration)
+        self._last_interfaces = []
+
+        # Level Estimation Mode - "profile" (mean row profile) or "columns" (per-strip robust fit)
+        self.analyzer_mode = "profile"
+        self.column_strips = 8
+        self.fit_degree = 1
+        self._last_fit = None
+
         print("Creating PMI_Edge_Detector...")
-        self.detector = PMI_Edge_Detector(max_dim=150)
+        self.detector = create_detector("pmi", max_dim=150)
+        self.shadow = None  # ShadowRunner for a candidate backend, None when disabled
         print("Creating ResultAnalyzer...")
         self.analyzer = ResultAnalyzer()
         print("CameraService initialized.")
 
+    # ======================================================
+    # TARGET FPS
+    # ======================================================
+    def set_target_fps(self, value):
+        """Change the capture / feed frame rate"""
+        self.target_fps = value if value > 0 else 30.0
+        print(f"Target FPS: {self.target_fps}")
+        self.save_checkpoint()
+
     # ======================================================
     # AUTO LIGHTING ADJUSTMENT (CLAHE)
     # ======================================================
@@ -88,7 +162,9 @@ class CameraService:
         self.auto_lighting_enabled = enabled
         if clip_limit is not None:
             self.clahe_clip_limit = max(0.1, min(10.0, clip_limit))
+        self._invalidate_motion_gate()
         print(f"Auto lighting: {enabled}, clip_limit: {self.clahe_clip_limit}")
+        self.save_checkpoint()
 
     def get_auto_lighting_settings(self):
         """Get current auto lighting settings"""
@@ -97,23 +173,83 @@ class CameraService:
             "clip_limit": self.clahe_clip_limit
         }
 
+    # ======================================================
+    # MOTION GATE
+    # ======================================================
+    def set_motion_gate(self, enabled, threshold=None, max_carry_forward=None):
+        """Enable/disable motion gating and optionally tune its thresholds"""
+        self.motion_gate_enabled = enabled
+        if threshold is not None:
+            self.motion_threshold = max(0.0, threshold)
+        if max_carry_forward is not None:
+            self.max_carry_forward = max(0, int(max_carry_forward))
+        self._invalidate_motion_gate()
+        print(f"Motion gate: {enabled}, threshold: {self.motion_threshold}, "
+              f"max_carry_forward: {self.max_carry_forward}")
+        self.save_checkpoint()
+
+    def get_motion_gate_settings(self):
+        """Get current motion gate settings"""
+        return {
+            "enabled": self.motion_gate_enabled,
+            "threshold": self.motion_threshold,
+            "max_carry_forward": self.max_carry_forward
+        }
+
+    def _roi_signature(self, img):
+        """Cheap scene fingerprint: downsampled greyscale ROI"""
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+        return small.astype(np.float32)
+
+    def _invalidate_motion_gate(self):
+        """Force a full detection on the next frame - the carried row is stale"""
+        self._gate_generation += 1
+        self._last_signature = None
+        self._carry_streak = 0
+
     # ======================================================
     # SET ROI (Region of Interest)
     # ======================================================
     def set_roi(self, x1, y1, x2, y2):
         """Set the region of interest for processing"""
         self.roi = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        self.auto_roi.reset()
+        self._invalidate_motion_gate()
         print(f"ROI set to: {self.roi}")
+        self.save_checkpoint()
 
     def clear_roi(self):
         """Clear ROI - process full frame"""
         self.roi = None
+        self.auto_roi.reset()
+        self._invalidate_motion_gate()
         print("ROI cleared - using full frame")
+        self.save_checkpoint()
 
     def get_roi(self):
         """Get current ROI coordinates"""
         return self.roi
 
+    # ======================================================
+    # AUTO ROI (proposal + tracking inside the user ROI)
+    # ======================================================
+    def set_auto_roi(self, enabled):
+        """Enable/disable automatic ROI proposal and tracking"""
+        self.auto_roi_enabled = enabled
+        self.auto_roi.reset()
+        self._invalidate_motion_gate()
+        print(f"Auto ROI: {enabled}")
+        self.save_checkpoint()
+
+    def get_auto_roi(self):
+        """Get auto ROI state and the crop currently being processed"""
+        return {
+            "enabled": self.auto_roi_enabled,
+            "ready": self.auto_roi.ready,
+            "crop": self.auto_roi.crop if self.auto_roi_enabled else None
+        }
+
     # ======================================================
     # CAPTURE SINGLE FRAME (for ROI selection)
     # ======================================================
@@ -149,30 +285,91 @@ class CameraService:
     # ======================================================
     # START SYSTEM
     # ======================================================
-    def start(self, source=0, calibration=1.0, output_folder="session_output"):
-
-        if self.running:
-            return
+    @property
+    def running(self):
+        return self.state in (STARTING, RUNNING)
+
+    def _set_state(self, new_state, only_from=None):
+        """Change lifecycle state; with only_from, only if currently in one of those states"""
+        with self._lifecycle_lock:
+            if only_from is not None and self.state not in only_from:
+                return False
+            self.state = new_state
+            return True
+
+    def _join_workers(self, timeout=None):
+        """Wait for the previous session's workers (incl. report writing) to finish"""
+        for t in (self._capture_thread, self._processing_thread):
+            if t is not None and t.is_alive() and t is not threading.current_thread():
+                t.join(timeout)
+
+    def start(self, source=0, calibration=1.0, output_folder="session_output", resume=False,
+              target_fps=None):
+        """Start a session; returns False (changing nothing) if one is already running"""
+
+        # A stop/start in quick succession waits for the draining session instead of racing it
+        if self.state == DRAINING:
+            self._join_workers()
+
+        with self._lifecycle_lock:
+            if self.state != IDLE:
+                return False
+            self.state = STARTING
+            # Each session gets its own stop event, so late workers of an old session never see a new one
+            self._stop_event = threading.Event()
 
+        try:
+            self._start_session(source, calibration, output_folder, resume, target_fps)
+        except Exception:
+            self._set_state(IDLE)
+            raise
+        return True
+
+    def _start_session(self, source, calibration, output_folder, resume, target_fps):
+        if target_fps is not None:
+            self.target_fps = target_fps if target_fps > 0 else 30.0
         self.calibration = calibration
         self.save_dir = output_folder
+        self.source = source
+        self._resumed = resume
 
         os.makedirs(self.save_dir, exist_ok=True)
         os.makedirs(os.path.join(self.save_dir, "Processed_Images"), exist_ok=True)
-
-        self.running = True
-        self.ref_row = None
+        self.history.open(self.save_dir, resume=resume)
+        self.storage.set_active(self.save_dir)
+        if resume:
+            self.history.truncate_after(self.frame_count)
+
+        if not resume:
+            # Fresh session - a resumed one keeps its zero, frame numbering and position
+            self.ref_row = None
+            self.interface_refs = {}
+            self.frame_count = 0
+            self._capture_pos = 0
         self._last_row = None
+        self._last_signature = None
+        self._carry_streak = 0
+        self._last_img_path = None
+        self.carried_frames = 0
+        self.auto_roi.reset()
+        self.interface_tracker.reset()
+        self._last_interfaces = []
+        self._last_fit = None
+        with self.frame_lock:
+            self.latest_frame = None
+            self.latest_frame_process = None
         self.data_results = []
-        self.frame_count = 0
-        self.current_fps = 0.0
-        self.current_processing_time = 0.0
         self.dropped_frames = 0
+        self._rate.reset()
+        self._stats = EMPTY_STATS._replace(
+            level=self._stats.level if resume else 0.0, frame_count=self.frame_count
+        )
 
         # Clear any leftover items from previous session
         while not self.save_queue.empty():
             try:
                 self.save_queue.get_nowait()
+                self.save_queue.task_done()
             except queue.Empty:
                 break
 
@@ -201,74 +398,380 @@ class CameraService:
                         print(f"Using fallback video: {fallback_video}")
                         self.cap = cv2.VideoCapture(fallback_video)
                     else:
-                        self.running = False
                         raise Exception("No camera and no video files found.")
 
                 else:
-                    self.running = False
                     raise Exception("uploaded_videos folder not found.")
 
             else:
-                self.running = False
                 raise Exception("Cannot open provided video file.")
 
         if not self.cap.isOpened():
-            self.running = False
             raise Exception("Unable to open any video source.")
 
-        threading.Thread(target=self._capture_loop, daemon=True).start()
-        threading.Thread(target=self._processing_loop, daemon=True).start()
+        # Video files continue where the previous run stopped; live cameras report no frame count
+        if resume and self._capture_pos > 0 and self.cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self._capture_pos)
+
+        self.save_checkpoint()
+
+        stop_event = self._stop_event
+        self._capture_thread = threading.Thread(
+            target=self._capture_loop, args=(self.cap, stop_event), daemon=True
+        )
+        self._processing_thread = threading.Thread(
+            target=self._processing_loop, args=(stop_event, self.save_dir), daemon=True
+        )
+        self._capture_thread.start()
+        self._processing_thread.start()
+
+        # stop() may already have been called while starting
+        self._set_state(RUNNING, only_from=(STARTING,))
 
     # ======================================================
     # STOP SYSTEM
     # ======================================================
-    def stop(self):
-        self.running = False
+    def stop(self, wait=False):
+        if self._set_state(DRAINING, only_from=(STARTING, RUNNING)):
+            self._stop_event.set()
+            self.save_checkpoint()  # Clean stop - do not resume this session on restart
 
         # self.cap.release() is handled in _capture_loop
+        # The processing loop saves the report, then moves the state back to IDLE
+        if wait:
+            self._join_workers()
+
+    # ======================================================
+    # CHECKPOINT / RESUME
+    # ======================================================
+    def _checkpoint_state(self):
+        """Small snapshot of config + measurement state (no per-frame results)"""
+        # Rows come out of numpy as float32, which json cannot serialise
+        as_float = lambda v: float(v) if v is not None else None
+        return {
+            "saved_at": time.time(),
+            "running": self.running,
+            "source": self.source,
+            "save_dir": self.save_dir,
+            "target_fps": self.target_fps,
+            "calibration": self.calibration,
+            "roi": list(self.roi) if self.roi is not None else None,
+            "auto_lighting_enabled": self.auto_lighting_enabled,
+            "clahe_clip_limit": self.clahe_clip_limit,
+            "motion_gate": self.get_motion_gate_settings(),
+            "auto_roi_enabled": self.auto_roi_enabled,
+            "analyzer": self.get_analyzer_settings(),
+            "detector": {"backend": self.detector.name, "params": self.detector.get_params()},
+            "num_interfaces": self.num_interfaces,
+            "interface_prominence": self.interface_prominence,
+            "interface_min_separation": self.interface_min_separation,
+            "interface_refs": {i: as_float(r) for i, r in self.interface_refs.items()},
+            "interface_calibrations": self.interface_calibrations,
+            "storage": self.get_storage_budget(),
+            "ref_row": as_float(self.ref_row),
+            "current_level": as_float(self._stats.level),
+            "frame_count": self.frame_count,
+            "capture_pos": self._capture_pos,
+        }
+
+    def save_checkpoint(self):
+        """Atomically write the checkpoint file; never raises into the caller"""
+        if self._restoring:
+            return
+        try:
+            state = self._checkpoint_state()
+            with self._checkpoint_lock:
+                write_checkpoint(self.checkpoint_path, state)
+            self._last_checkpoint = state["saved_at"]
+        except Exception as e:
+            print(f"Error writing checkpoint: {e}")
 
-        # Wait a bit for threads to clean up or just return (daemon threads will die)
-        # We can't easily wait for daemon threads, but we can signal them.
-        # The processing loop will call _save_report when it exits.
+    def resume(self):
+        """
+        Restore config from the last checkpoint and, if a session was running
+        when the process died, continue it. Results are not replayed - they
+        are already in the session's history database.
+        """
+        state = load_checkpoint(self.checkpoint_path)
+        if state is None:
+            return False
+
+        # Setters would overwrite the checkpoint with a half-restored (not running) state
+        defaults = self._checkpoint_state()
+        self._restoring = True
+        try:
+            self._restore_config(state)
+            running = state["running"]
+            if running:
+                session = [state[k] for k in ("ref_row", "frame_count", "current_level", "capture_pos")]
+        except Exception as e:
+            # Unknown backend, missing key, ... - keep the server usable with defaults
+            print(f"Ignoring invalid checkpoint {self.checkpoint_path}: {e}")
+            self._restore_config(defaults)
+            return False
+        finally:
+            self._restoring = False
+        print(f"Restored configuration from {self.checkpoint_path}")
+
+        if not running:
+            return False
+
+        self.ref_row, self.frame_count, level, self._capture_pos = session
+        self._stats = self._stats._replace(level=level, frame_count=self.frame_count)
+        print(f"Resuming session in {self.save_dir} at frame {self.frame_count}...")
+        try:
+            self.start(source=self.source, calibration=self.calibration,
+                       output_folder=self.save_dir, resume=True)
+        except Exception as e:
+            print(f"Could not resume session: {e}")
+            self.save_checkpoint()
+            return False
+        return True
+
+    def _restore_config(self, state):
+        """Apply the configuration part of a checkpoint"""
+        self.target_fps = state["target_fps"]
+        self.calibration = state["calibration"]
+        self.roi = tuple(state["roi"]) if state["roi"] is not None else None
+        self.auto_lighting_enabled = state["auto_lighting_enabled"]
+        self.clahe_clip_limit = state["clahe_clip_limit"]
+        self.set_motion_gate(**state["motion_gate"])
+        self.set_auto_roi(state["auto_roi_enabled"])
+        self.set_analyzer_mode(**state["analyzer"])
+        self.set_detector(state["detector"]["backend"], **state["detector"]["params"])
+        self.set_interfaces(state["num_interfaces"], state["interface_prominence"],
+                            state["interface_min_separation"])
+        # JSON object keys are strings
+        self.interface_refs = {int(k): v for k, v in state["interface_refs"].items()}
+        self.interface_calibrations = {int(k): v for k, v in state["interface_calibrations"].items()}
+        # Checkpoints written before storage budgets were saved keep the defaults
+        self.storage.set_budget(**state.get("storage", {}))
+        self.save_dir = state["save_dir"]
+        self.source = state["source"]
 
     # ======================================================
     # SET CALIBRATION
     # ======================================================
-    def set_calibration(self, value):
-        """Change calibration factor on-the-fly"""
-        self.calibration = max(0.1, value)
-        print(f"Calibration set to: {self.calibration}")
+    def set_calibration(self, value, interface=None):
+        """Change calibration factor on-the-fly (optionally for one interface)"""
+        if interface is not None:
+            self.interface_calibrations[interface] = max(0.1, value)
+            print(f"Calibration for interface {interface} set to: {self.interface_calibrations[interface]}")
+        else:
+            self.calibration = max(0.1, value)
+            print(f"Calibration set to: {self.calibration}")
+        self.save_checkpoint()
 
     # ======================================================
     # SET ZERO REFERENCE
     # ======================================================
-    def set_reference(self):
+    def set_reference(self, interface=None):
+        if interface is not None:
+            if interface >= len(self._last_interfaces) or self._last_interfaces[interface] is None:
+                raise Exception(f"Interface {interface} not detected yet.")
+            self.interface_refs[interface] = self._last_interfaces[interface]
+            print(f"Reference set for interface {interface}.")
+            self.save_checkpoint()
+            return
+
         if self._last_row is None:
             raise Exception("No frame processed yet.")
         self.ref_row = self._last_row
-        self.current_level = 0.0 # Force immediate zero update
+        self._stats = self._stats._replace(level=0.0) # Force immediate zero update
+        # Zero every interface currently seen as well
+        for i, r in enumerate(self._last_interfaces):
+            if r is not None:
+                self.interface_refs[i] = r
         print("Reference set. Level reset to 0.0")
+        self.save_checkpoint()
+
+    # ======================================================
+    # MULTI-INTERFACE DETECTION
+    # ======================================================
+    def set_interfaces(self, count, prominence=None, min_separation=None):
+        """Set how many interfaces (e.g. foam/liquid, oil/water) to track"""
+        self.num_interfaces = max(1, int(count))
+        if prominence is not None:
+            self.interface_prominence = max(0.0, prominence)
+        if min_separation is not None:
+            self.interface_min_separation = max(1, int(min_separation))
+        self.interface_tracker = InterfaceTracker(num_interfaces=self.num_interfaces)
+        self.interface_refs = {}
+        self._last_interfaces = []
+        self._invalidate_motion_gate()
+        print(f"Interfaces: {self.num_interfaces}, prominence: {self.interface_prominence}, "
+              f"min_separation: {self.interface_min_separation}")
+        self.save_checkpoint()
+
+    def get_interface_settings(self):
+        """Get current multi-interface settings"""
+        return {
+            "count": self.num_interfaces,
+            "prominence": self.interface_prominence,
+            "min_separation": self.interface_min_separation,
+            "references": self.interface_refs,
+            "calibrations": self.interface_calibrations
+        }
+
+    # ======================================================
+    # LEVEL ESTIMATION MODE
+    # ======================================================
+    def set_analyzer_mode(self, mode, strips=None, degree=None):
+        """Switch between mean-profile and tilt-robust column-fit level estimation"""
+        if mode not in ("profile", "columns"):
+            raise ValueError("Analyzer mode must be 'profile' or 'columns'")
+        self.analyzer_mode = mode
+        if strips is not None:
+            self.column_strips = max(1, int(strips))
+        if degree is not None:
+            self.fit_degree = max(0, min(2, int(degree)))
+        self._invalidate_motion_gate()
+        print(f"Analyzer mode: {mode}, strips: {self.column_strips}, degree: {self.fit_degree}")
+        self.save_checkpoint()
+
+    def get_analyzer_settings(self):
+        """Get current level estimation settings"""
+        return {
+            "mode": self.analyzer_mode,
+            "strips": self.column_strips,
+            "degree": self.fit_degree
+        }
+
+    def _estimate_row(self, edge):
+        """Level row (crop coordinates) and optional column fit from an edge map"""
+        if self.analyzer_mode == "columns":
+            fit = self.analyzer.get_column_fit(
+                edge, strips=self.column_strips, degree=self.fit_degree
+            )
+            return fit["row"], fit
+        return self.analyzer.get_subpixel_row(edge), None
+
+    # ======================================================
+    # DETECTOR BACKEND (runtime switching + shadow mode)
+    # ======================================================
+    def set_detector(self, backend=None, **params):
+        """Switch detector backend and/or its parameters on-the-fly"""
+        backend = backend or self.detector.name
+        if backend == self.detector.name:
+            params = {**self.detector.get_params(),
+                      **{k: v for k, v in params.items() if v is not None}}
+        # Build first, then swap in one assignment - the processing loop never sees a half-built detector
+        self.detector = create_detector(backend, **params)
+        self._invalidate_motion_gate()
+        print(f"Detector set to: {backend} {self.detector.get_params()}")
+        self.save_checkpoint()
+
+    def get_detector_settings(self):
+        """Get current detector backend, its parameters and the available backends"""
+        return {
+            "backend": self.detector.name,
+            "params": self.detector.get_params(),
+            "available": list(DETECTORS)
+        }
+
+    def set_shadow(self, enabled, backend=None, sample_every=10, **params):
+        """Run a candidate backend on every Nth frame and compare against the primary"""
+        if self.shadow is not None:
+            self.shadow.stop()
+            self.shadow = None
+        if not enabled:
+            print("Shadow mode disabled")
+            return
+
+        candidate = create_detector(backend, **params)
+        self.shadow = ShadowRunner(
+            candidate,
+            estimate_row=lambda edge: self._estimate_row(edge)[0],
+            sample_every=sample_every
+        )
+        print(f"Shadow mode: {backend} {candidate.get_params()} every {self.shadow.sample_every} frames")
+
+    def get_shadow_stats(self):
+        """Latency and level disagreement of the shadow backend vs the primary"""
+        if self.shadow is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "backend": self.shadow.detector.name,
+            "params": self.shadow.detector.get_params(),
+            "sample_every": self.shadow.sample_every,
+            **self.shadow.get_stats()
+        }
+
+    def _release_interfaces(self, ids):
+        """A lost interface freed its id - its zero and calibration must not pass to the next one"""
+        if not any(i in self.interface_refs or i in self.interface_calibrations for i in ids):
+            return
+        # Replace rather than mutate - API threads may be reading the old dicts
+        self.interface_refs = {i: r for i, r in self.interface_refs.items() if i not in ids}
+        self.interface_calibrations = {
+            i: c for i, c in self.interface_calibrations.items() if i not in ids
+        }
+        print(f"Interfaces {ids} lost - reference and calibration cleared")
+        self.save_checkpoint()
+
+    def _interface_heights(self, rows):
+        """Height per tracked interface using its own reference and calibration"""
+        result = []
+        for i, r in enumerate(rows):
+            height = None
+            ref = self.interface_refs.get(i)
+            if r is not None and ref is not None:
+                cal = self.interface_calibrations.get(i, self.calibration)
+                height = round((ref - r) / cal, 2)
+            result.append({"id": i, "row": r, "height": height})
+        return result
 
     # ======================================================
     # GET CURRENT LEVEL
     # ======================================================
     def get_level(self):
-        if self.current_level is None:
+        level = self._stats.level
+        if level is None:
             return None
-        return float(self.current_level)
+        return float(level)
 
     # ======================================================
     # GET STATS
     # ======================================================
     def get_stats(self):
+        # One reference read - the snapshot is never mutated, so no lock is needed
+        snap = self._stats
         return {
-            "level": self.get_level(),
-            "fps": float(self.current_fps),
-            "processing_time": float(self.current_processing_time),
-            "frame_count": int(self.frame_count),
-            "running": self.running
+            **snap._asdict(),
+            "level": float(snap.level) if snap.level is not None else None,
+            "interfaces": list(snap.interfaces),
+            "running": self.running,
+            "state": self.state
         }
 
+    # ======================================================
+    # GET HISTORY
+    # ======================================================
+    def get_history(self, output_folder=None, **query):
+        """Query stored readings of the current (or a previous) session"""
+        if output_folder is None or output_folder == self.save_dir:
+            # Make rows buffered by the running session visible immediately
+            self.history.flush()
+            output_folder = self.save_dir
+        return query_history(history_path(output_folder), **query)
+
+    # ======================================================
+    # STORAGE
+    # ======================================================
+    def set_storage_budget(self, session_budget_mb=None, total_budget_mb=None, keep_every=None):
+        """Change the disk budgets and thinning rate of the storage manager"""
+        self.storage.set_budget(session_budget_mb, total_budget_mb, keep_every)
+        self.save_checkpoint()
+
+    def get_storage_budget(self):
+        settings = self.storage.get_settings()
+        return {k: settings[k] for k in ("session_budget_mb", "total_budget_mb", "keep_every")}
+
+    def get_storage_usage(self):
+        """Disk usage per session, write rate and compaction stats"""
+        return self.storage.usage()
+
     # ======================================================
     # GET LATEST FRAME
     # ======================================================
@@ -278,18 +781,16 @@ class CameraService:
     # ======================================================
     # CAPTURE LOOP (RUNS AT TARGET FPS)
     # ======================================================
-    def _capture_loop(self):
+    def _capture_loop(self, cap, stop_event):
         print("Starting capture loop...")
         
-        while self.running:
-            if self.cap is None:
-                time.sleep(0.1)
-                continue
-
-            ret, frame = self.cap.read()
+        while not stop_event.is_set():
+            ret, frame = cap.read()
             if not ret:
                 print("Video ended or frame read failed.")
-                self.running = False
+                # Same path as stop(): drain and save the report
+                self._set_state(DRAINING, only_from=(STARTING, RUNNING))
+                stop_event.set()
                 break
 
             # --- Apply auto lighting adjustment (CLAHE) ---
@@ -301,121 +802,250 @@ class CameraService:
             clean_process_frame = frame.copy() # Keep a clean copy!
 
             # Draw ROI rectangle on display frame if ROI is set
-            if self.roi is not None:
-                x1, y1, x2, y2 = self.roi
+            roi = self.roi
+            if roi is not None:
+                x1, y1, x2, y2 = roi
                 cv2.rectangle(display_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
                 cv2.putText(display_frame, "ROI", (x1, y1 - 10),
                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
+            # Draw the automatic crop inside it
+            crop = self.auto_roi.crop if self.auto_roi_enabled else None
+            if crop is not None:
+                x1, y1, x2, y2 = crop
+                cv2.rectangle(display_frame, (x1, y1), (x2, y2), (255, 128, 0), 1)
+
             with self.frame_lock:
                 self.latest_frame = display_frame
                 self.latest_frame_process = clean_process_frame
+                self._frame_time = time.time()
+                self._frame_seq += 1
+                self._capture_pos += 1
 
             # Use target_fps to control frame delay for the FEED
             frame_delay = 1.0 / self.target_fps if self.target_fps > 0 else 0.033
             time.sleep(frame_delay)
 
-        if self.cap:
-            self.cap.release()
+        cap.release()
         print("Capture loop ended.")
 
     # ======================================================
     # PROCESSING LOOP (RUNS AS FAST AS POSSIBLE)
     # ======================================================
-    def _processing_loop(self):
+    def _processing_loop(self, stop_event, save_dir):
         print("Starting processing loop...")
-        
-        while self.running:
+        try:
+            self._process_frames(stop_event)
+        except Exception as e:
+            print(f"Processing loop error: {e}")
+            self._set_state(DRAINING, only_from=(STARTING, RUNNING))
+            stop_event.set()
+        finally:
+            try:
+                # Wait for all pending saves to complete before generating report
+                print(f"Waiting for {self.save_queue.qsize()} pending saves to complete...")
+                self.save_queue.join()
+                print("All frames saved.")
+
+                self.history.close()
+                self.save_checkpoint()
+                self._save_report(save_dir)
+                print("Processing loop ended and report saved.")
+            except Exception as e:
+                # Disk full, locked xlsx, ... - the results stay in the history database
+                print(f"Error finishing session in {save_dir}: {e}")
+            finally:
+                # Never leave the service stuck in DRAINING - start() would refuse forever
+                self._set_state(IDLE)
+
+    def _process_frames(self, stop_event):
+        last_seq = -1
+
+        while not stop_event.is_set():
             
-            # Get latest clean frame safely
+            # Get latest clean frame safely - each captured frame is processed at most once.
+            # The capture loop always publishes a fresh array, so no copy is needed here.
             process_frame = None
             with self.frame_lock:
-                if self.latest_frame_process is not None:
-                    process_frame = self.latest_frame_process.copy()
+                if self.latest_frame_process is not None and self._frame_seq != last_seq:
+                    process_frame = self.latest_frame_process
+                    captured_at = self._frame_time
+                    last_seq = self._frame_seq
             
             if process_frame is None:
-                time.sleep(0.1)
+                time.sleep(0.005)
                 continue
 
             self.frame_count += 1
             start_time = time.time()
 
+            # Settings changed from API threads are read once per frame
+            roi = self.roi
+            calibration = self.calibration
+            ref_row = self.ref_row
+
             # -------- EXTRACT ROI FOR PROCESSING --------
-            if self.roi is not None:
-                x1, y1, x2, y2 = self.roi
-                h, w = process_frame.shape[:2]
-                x1, y1 = max(0, x1), max(0, y1)
-                x2, y2 = min(w, x2), min(h, y2)
+            h, w = process_frame.shape[:2]
+            x1, y1, x2, y2 = 0, 0, w, h
+            if roi is not None:
+                rx1, ry1, rx2, ry2 = roi
+                rx1, ry1 = max(0, rx1), max(0, ry1)
+                rx2, ry2 = min(w, rx2), min(h, ry2)
                 # Ensure coordinates are valid
-                if x2 > x1 and y2 > y1:
-                    img_for_detection = process_frame[y1:y2, x1:x2]
-                else:
-                    img_for_detection = process_frame
+                if rx2 > rx1 and ry2 > ry1:
+                    x1, y1, x2, y2 = rx1, ry1, rx2, ry2
+
+            # Auto ROI shrinks the crop further, the user ROI stays the outer bound
+            if self.auto_roi_enabled:
+                x1, y1, x2, y2 = self.auto_roi.update(process_frame, (x1, y1, x2, y2))
+
+            img_for_detection = process_frame[y1:y2, x1:x2]
+
+            # -------- MOTION GATE --------
+            # Compare against the last *detected* frame so slow drift still triggers a detection
+            carried = False
+            gate_generation = self._gate_generation
+            if self.motion_gate_enabled:
+                signature = self._roi_signature(img_for_detection)
+                if (self._last_signature is not None
+                        and self._last_row is not None
+                        and self._carry_streak < self.max_carry_forward):
+                    # Max, not mean: a level step only changes one band of cells, while
+                    # area-averaged cells keep sensor noise well below the threshold
+                    diff = float(np.max(np.abs(signature - self._last_signature)))
+                    carried = diff < self.motion_threshold
             else:
-                img_for_detection = process_frame
+                signature = None
 
             # -------- PROCESS FRAME --------
-            # This is the heavy blocking call
-            edge = self.detector.detect(img_for_detection)
-            row = self.analyzer.get_subpixel_row(edge)
-            self._last_row = row
+            if carried:
+                row = self._last_row
+                interfaces = self._last_interfaces
+                fit = self._last_fit
+                confidence = self._stats.confidence
+                self._carry_streak += 1
+                self.carried_frames += 1
+            else:
+                # This is the heavy blocking call
+                result = self.detector.detect_timed(img_for_detection)
+                # Rows are kept in full-frame coordinates so a moving crop keeps the reference valid
+                row, fit = self._estimate_row(result["edge"])
+                row += y1
+
+                # With several interfaces the band must keep all of them, so only narrow on one
+                if (self.auto_roi_enabled
+                        and not self.auto_roi.observe(row, narrow=self.num_interfaces == 1)):
+                    # The crop disagrees with the last trusted level - detect on the full ROI
+                    x1, y1, x2, y2 = self.auto_roi.crop
+                    img_for_detection = process_frame[y1:y2, x1:x2]
+                    result = self.detector.detect_timed(img_for_detection)
+                    row, fit = self._estimate_row(result["edge"])
+                    row += y1
+                    self.auto_roi.observe(row)
+                    signature = self._roi_signature(img_for_detection) if signature is not None else None
+
+                edge = result["edge"]
+                confidence = result["confidence"]
+                self._last_row = row
+                self._last_fit = fit
+
+                shadow = self.shadow
+                if shadow is not None:
+                    shadow.offer(self.frame_count, img_for_detection, y1, row, result["time"])
+
+                # Extra interfaces come from the same edge map - no second detection
+                interfaces = []
+                if self.num_interfaces > 1:
+                    rows = self.analyzer.get_interface_rows(
+                        edge, k=self.num_interfaces,
+                        prominence=self.interface_prominence,
+                        min_separation=self.interface_min_separation
+                    ) + y1
+                    tracker = self.interface_tracker
+                    interfaces = tracker.update(rows)
+                    if tracker.released:
+                        self._release_interfaces(tracker.released)
+                self._last_interfaces = interfaces
+
+                # A setting changed mid-detection: this result must not be carried forward
+                if gate_generation == self._gate_generation:
+                    self._last_signature = signature
+                self._carry_streak = 0
 
             processing_time = time.time() - start_time
             
-            # --- Throughput FPS Calculation ---
+            # --- Throughput FPS + latency (O(1) ring buffer) ---
             now = time.time()
-            self._fps_window.append(now)
-            # Remove timestamps older than 1 second
-            while self._fps_window and now - self._fps_window[0] > 1.0:
-                self._fps_window.pop(0)
-            
-            # FPS is the number of frames processed in the last second
-            fps = len(self._fps_window)
-
-            self.current_fps = fps
-            self.current_processing_time = processing_time
+            self._rate.add(now, now - captured_at)
+            fps = self._rate.rate()
 
             # -------- SAVE EDGE IMAGE --------
             ts = datetime.datetime.now().strftime("%H_%M_%S_%f")
-            edge_uint8 = (edge * 255).astype(np.uint8)
 
-            img_path = os.path.join(
-                self.save_dir,
-                "Processed_Images",
-                f"frame_{self.frame_count}_{ts}.png"
-            )
-            
-            # ASYNC SAVE: Use blocking put() to ensure ALL frames are saved
-            # This matches the original behavior where cv2.imwrite was blocking
-            self.save_queue.put((img_path, edge_uint8))
+            if carried:
+                # Unchanged scene - point at the edge image it was carried from
+                img_path = self._last_img_path
+            else:
+                edge_uint8 = (edge * 255).astype(np.uint8)
+
+                img_path = os.path.join(
+                    self.save_dir,
+                    "Processed_Images",
+                    f"frame_{self.frame_count}_{ts}.png"
+                )
+                self._last_img_path = img_path
+
+                # ASYNC SAVE: Use blocking put() to ensure ALL detected frames are saved
+                # This matches the original behavior where cv2.imwrite was blocking
+                self.save_queue.put((img_path, edge_uint8))
 
             # -------- CALCULATE HEIGHT --------
             height = None
-            if self.ref_row is not None:
-                height = round((self.ref_row - row) / self.calibration, 2)
-                self.current_level = height
+            if ref_row is not None:
+                height = round((ref_row - row) / calibration, 2)
+
+            interface_levels = self._interface_heights(interfaces)
+
+            # -------- PUBLISH STATS SNAPSHOT --------
+            self._stats = StatsSnapshot(
+                level=height if height is not None else self._stats.level,
+                fps=fps,
+                processing_time=processing_time,
+                latency=self._rate.mean_latency(),
+                frame_count=self.frame_count,
+                carried_frames=self.carried_frames,
+                interfaces=tuple(interface_levels),
+                tilt=fit["tilt_deg"] if fit is not None else None,
+                confidence=confidence,
+                fit_residual=fit["residual"] if fit is not None else None
+            )
 
             # -------- STORE DATA --------
-            self.data_results.append({
+            record = {
                 "Frame_Number": self.frame_count,
                 "Timestamp": ts,
                 "SubPixel_Row": row,
                 "Height_cm": height,
                 "Processing_Time_sec": processing_time,
                 "FPS": fps,
-                "Image_Path": img_path
-            })
+                "Image_Path": img_path,
+                "Carried_Forward": carried
+            }
+            if fit is not None:
+                record["Tilt_deg"] = fit["tilt_deg"]
+                record["Fit_Residual"] = fit["residual"]
+            for item in interface_levels:
+                record[f"Interface_{item['id']}_Row"] = item["row"]
+                record[f"Interface_{item['id']}_Height_cm"] = item["height"]
+            self.data_results.append(record)
+            self.history.append(record, now)
+
+            # -------- PERIODIC CHECKPOINT --------
+            if now - self._last_checkpoint >= self.checkpoint_interval:
+                self.save_checkpoint()
             
             # No sleep here - process frames as fast as possible like original code
 
-        # Wait for all pending saves to complete before generating report
-        print(f"Waiting for {self.save_queue.qsize()} pending saves to complete...")
-        self.save_queue.join()
-        print("All frames saved.")
-
-        self._save_report()
-        print("Processing loop ended and report saved.")
-
 
     # ======================================================
     # SAVE FINAL REPORT
@@ -428,23 +1058,54 @@ class CameraService:
         while True:
             try:
                 path, img = self.save_queue.get()
-                cv2.imwrite(path, img)
-                self.save_queue.task_done()
             except Exception as e:
                 print(f"Error saving image: {e}")
+                continue
+            try:
+                # Encode + write ourselves so the storage manager gets the byte count for free
+                ok, buf = cv2.imencode(".png", img)
+                if ok:
+                    with open(path, "wb") as f:
+                        f.write(buf.tobytes())
+                    self.storage.record_write(len(buf))
+            except Exception as e:
+                print(f"Error saving image: {e}")
+            finally:
+                self.save_queue.task_done()
 
     # ======================================================
     # SAVE FINAL REPORT
     # ======================================================
-    def _save_report(self):
-
-        if not self.data_results:
+    def _report_records(self, save_dir):
+        """Session results; a resumed session adds the rows stored before the restart"""
+        if not self._resumed:
+            return self.data_results
+
+        first_frame = self.data_results[0]["Frame_Number"] if self.data_results else None
+        earlier = query_history(history_path(save_dir), limit=-1,
+                                end_frame=first_frame - 1 if first_frame is not None else None)
+        restored = [{
+            "Frame_Number": r["frame_number"],
+            "Timestamp": r["timestamp"],
+            "SubPixel_Row": r["subpixel_row"],
+            "Height_cm": r["height_cm"],
+            "Processing_Time_sec": r["processing_time_sec"],
+            "FPS": r["fps"],
+            "Image_Path": r["image_path"],
+            "Carried_Forward": bool(r["carried_forward"])
+        } for r in earlier]
+        return restored + self.data_results
+
+    def _save_report(self, save_dir):
+
+        records = self._report_records(save_dir)
+        if not records:
             print("No data collected.")
             return
 
-        df = pd.DataFrame(self.data_results)
+        df = pd.DataFrame(records)
 
-        excel_path = os.path.join(self.save_dir, "Final_Report.xlsx")
+        excel_path = os.path.join(save_dir, "Final_Report.xlsx")
         df.to_excel(excel_path, index=False)
 
         # Plot Trend Graph
@@ -456,7 +1117,7 @@ class CameraService:
             plt.ylabel("Level (cm)")
             plt.grid(True)
 
-            graph_path = os.path.join(self.save_dir, "Trend_Graph.png")
+            graph_path = os.path.join(save_dir, "Trend_Graph.png")
             plt.savefig(graph_path)
             plt.close()
             print("Session saved successfully.")
@@ -0,0 +1,36 @@
+import json
+import os
+
+
+CHECKPOINT_FILE = "session_checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+
+def write_checkpoint(path, state):
+    """
+    Atomically replace the checkpoint file.
+    The state is written to a temp file, fsynced, then renamed over the old
+    one, so a power cut leaves either the previous or the new checkpoint.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": CHECKPOINT_VERSION, **state}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """Return the saved state, or None if there is no usable checkpoint"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+    if state.get("version") != CHECKPOINT_VERSION:
+        print(f"Ignoring checkpoint with unsupported version: {state.get('version')}")
+        return None
+    return state
@@ -1,3 +1,5 @@
+import time
+
 import numpy as np
 import cv2
 
@@ -8,7 +10,55 @@ from sklearn.neighbors import radius_neighbors_graph
 from skimage import color, util, io
 
 
-class PMI_Edge_Detector:
+class EdgeDetector:
+    """
+    Common interface for detector backends.
+
+    detect(image) returns a float edge map in [0, 1] with the same size as
+    the input; detect_timed(image) adds a confidence score and timing.
+    PARAMS lists the constructor arguments that can be changed at runtime;
+    PARAM_MIN gives their lower bound as (minimum, minimum itself allowed).
+    """
+    name = None
+    PARAMS = ()
+    PARAM_MIN = {}
+
+    @classmethod
+    def check_params(cls, params):
+        """Raise ValueError for a runtime parameter outside its valid range"""
+        for k, v in params.items():
+            if k not in cls.PARAM_MIN:
+                continue
+            low, inclusive = cls.PARAM_MIN[k]
+            if not (v >= low if inclusive else v > low):
+                bound = f">= {low}" if inclusive else f"> {low}"
+                raise ValueError(f"Invalid {cls.name} parameter {k}={v}: must be {bound}")
+
+    def detect(self, image_input):
+        raise NotImplementedError
+
+    def get_params(self):
+        return {k: getattr(self, k) for k in self.PARAMS}
+
+    def detect_timed(self, image_input):
+        start = time.time()
+        edge = self.detect(image_input)
+        elapsed = time.time() - start
+
+        # Confidence: how much the strongest row stands out from a typical row
+        profile = np.mean(edge, 1)
+        peak = float(profile.max()) if profile.size else 0.0
+        confidence = (peak - float(np.median(profile))) / (peak + 1e-8) if peak > 0 else 0.0
+
+        return {"edge": edge, "confidence": confidence, "time": elapsed}
+
+
+class PMI_Edge_Detector(EdgeDetector):
+    name = "pmi"
+    PARAMS = ("num_eigenvecs", "sigma", "radius", "max_dim")
+    PARAM_MIN = {"num_eigenvecs": (1, True), "sigma": (0, False),
+                 "radius": (0, False), "max_dim": (8, True)}
+
     def __init__(self, num_eigenvecs=5, sigma=0.1, radius=0.2, max_dim=150):
         """
         num_eigenvecs : number of non-trivial eigenvectors
@@ -116,7 +166,7 @@ class PMI_Edge_Detector:
 
         scale = self.max_dim / max(orig_h, orig_w)
         if scale < 1.0:
-            new_h, new_w = int(orig_h * scale), int(orig_w * scale)
+            new_h, new_w = max(1, int(orig_h * scale)), max(1, int(orig_w * scale))
             img_small = cv2.resize(
                 img, (new_w, new_h), interpolation=cv2.INTER_AREA
             )
@@ -147,3 +197,66 @@ class PMI_Edge_Detector:
             final_edge.max() - final_edge.min() + 1e-8
         )
         return final_edge
+
+
+class SobelEdgeDetector(EdgeDetector):
+    """
+    Cheap gradient-magnitude detector - a fast baseline for shadow comparisons.
+    """
+    name = "sobel"
+    PARAMS = ("sigma", "max_dim")
+    PARAM_MIN = {"sigma": (0, True), "max_dim": (8, True)}
+
+    def __init__(self, sigma=1.0, max_dim=150):
+        """
+        sigma   : Gaussian blur applied before the gradient (pixels, downscaled image)
+        max_dim : image scaled so max(H, W) = max_dim for speed
+        """
+        self.sigma = sigma
+        self.max_dim = max_dim
+
+    def detect(self, image_input):
+        if isinstance(image_input, str):
+            image_input = cv2.imread(image_input)
+
+        gray = image_input
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+        gray = gray.astype(np.float32) / 255.0
+
+        orig_h, orig_w = gray.shape
+        scale = self.max_dim / max(orig_h, orig_w)
+        if scale < 1.0:
+            gray = cv2.resize(
+                gray, (max(1, int(orig_w * scale)), max(1, int(orig_h * scale))),
+                interpolation=cv2.INTER_AREA
+            )
+
+        if self.sigma > 0:
+            gray = cv2.GaussianBlur(gray, (0, 0), self.sigma)
+
+        gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+        gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+        edge = cv2.magnitude(gx, gy)
+
+        if edge.shape != (orig_h, orig_w):
+            edge = cv2.resize(edge, (orig_w, orig_h), interpolation=cv2.INTER_LINEAR)
+
+        return (edge - edge.min()) / (edge.max() - edge.min() + 1e-8)
+
+
+# Detector backends selectable at runtime (name -> class)
+DETECTORS = {
+    PMI_Edge_Detector.name: PMI_Edge_Detector,
+    SobelEdgeDetector.name: SobelEdgeDetector,
+}
+
+
+def create_detector(backend, **params):
+    """Instantiate a registered backend; parameters it does not use are ignored"""
+    if backend not in DETECTORS:
+        raise ValueError(f"Unknown detector backend '{backend}'. Use one of: {', '.join(DETECTORS)}")
+    cls = DETECTORS[backend]
+    kwargs = {k: v for k, v in params.items() if k in cls.PARAMS and v is not None}
+    cls.check_params(kwargs)
+    return cls(**kwargs)
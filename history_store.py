@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+HISTORY_DB_NAME = "history.db"
+
+# Aggregations allowed in bucketed history queries (name -> SQL function)
+AGGREGATES = {"avg": "AVG", "min": "MIN", "max": "MAX"}
+
+
+class HistoryStore:
+    """
+    Persistent per-session store of level readings.
+
+    Rows are buffered in memory and written to a SQLite database (WAL mode)
+    in batches, so the processing loop never waits on a commit per frame and
+    readers can query any time window while the session is still running.
+    """
+
+    def __init__(self, batch_size=50, flush_interval=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.db_path = None
+        self._conn = None
+        self._pending = []
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    # ======================================================
+    # OPEN / CLOSE
+    # ======================================================
+    def open(self, save_dir, resume=False):
+        """
+        Open (or create) the history database inside a session folder.
+        A fresh session clears rows left by an earlier run into the same folder;
+        a resumed one keeps them.
+        """
+        self.close()
+
+        self.db_path = history_path(save_dir)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS readings (
+                frame_number INTEGER NOT NULL,
+                epoch REAL NOT NULL,
+                timestamp TEXT,
+                subpixel_row REAL,
+                height_cm REAL,
+                processing_time_sec REAL,
+                fps REAL,
+                image_path TEXT,
+                carried_forward INTEGER DEFAULT 0
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_epoch ON readings (epoch)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_frame ON readings (frame_number)")
+        if not resume:
+            conn.execute("DELETE FROM readings")
+        conn.commit()
+
+        with self._lock:
+            self._conn = conn
+            self._pending = []
+            self._last_flush = time.time()
+
+    def close(self):
+        """Flush pending rows and close the database"""
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def truncate_after(self, frame_number):
+        """Drop rows newer than a checkpoint - they are re-processed after a resume"""
+        self.flush()
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute("DELETE FROM readings WHERE frame_number > ?", (frame_number,))
+            self._conn.commit()
+
+    # ======================================================
+    # WRITE (BATCHED)
+    # ======================================================
+    def append(self, record, epoch):
+        """Buffer one result record; flushes when the batch is full or stale"""
+        with self._lock:
+            if self._conn is None:
+                return
+            # numpy scalars would be stored as BLOBs - write plain Python numbers
+            self._pending.append((
+                int(record["Frame_Number"]),
+                float(epoch),
+                record["Timestamp"],
+                _as_float(record["SubPixel_Row"]),
+                _as_float(record["Height_cm"]),
+                _as_float(record["Processing_Time_sec"]),
+                _as_float(record["FPS"]),
+                record["Image_Path"],
+                int(record.get("Carried_Forward", False)),
+            ))
+            should_flush = (
+                len(self._pending) >= self.batch_size
+                or epoch - self._last_flush >= self.flush_interval
+            )
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows in a single transaction"""
+        with self._lock:
+            if self._conn is None or not self._pending:
+                return
+            rows, self._pending = self._pending, []
+            try:
+                self._conn.executemany(
+                    "INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing history batch: {e}")
+            self._last_flush = time.time()
+
+
+def _as_float(value):
+    return float(value) if value is not None else None
+
+
+def history_path(save_dir):
+    return os.path.join(save_dir, HISTORY_DB_NAME)
+
+
+def query_history(db_path, start=None, end=None, start_frame=None, end_frame=None,
+                  every=1, bucket=None, agg="avg", limit=10000):
+    """
+    Read readings from a session history database.
+
+    start / end             : epoch seconds (inclusive range)
+    start_frame / end_frame : frame number range (inclusive)
+    every                   : keep every Nth frame (downsampling)
+    bucket                  : aggregate into buckets of this many seconds
+    agg                     : aggregation used per bucket (avg, min, max)
+    limit                   : maximum number of rows returned
+    """
+    if agg not in AGGREGATES:
+        raise ValueError(f"Unknown aggregation '{agg}'. Use one of: {', '.join(AGGREGATES)}")
+
+    if not os.path.exists(db_path):
+        return []
+
+    where, params = [], []
+    if start is not None:
+        where.append("epoch >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("epoch <= ?")
+        params.append(end)
+    if start_frame is not None:
+        where.append("frame_number >= ?")
+        params.append(start_frame)
+    if end_frame is not None:
+        where.append("frame_number <= ?")
+        params.append(end_frame)
+    if every is not None and every > 1:
+        where.append("frame_number % ? = 0")
+        params.append(int(every))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    if bucket is not None and bucket > 0:
+        fn = AGGREGATES[agg]
+        sql = f"""
+            SELECT CAST(epoch / ? AS INTEGER) * ? AS bucket_start,
+                   COUNT(*) AS count,
+                   SUM(carried_forward) AS carried_count,
+                   MIN(frame_number) AS first_frame,
+                   MAX(frame_number) AS last_frame,
+                   {fn}(subpixel_row) AS subpixel_row,
+                   {fn}(height_cm) AS height_cm,
+                   {fn}(processing_time_sec) AS processing_time_sec
+            FROM readings {where_sql}
+            GROUP BY bucket_start
+            ORDER BY bucket_start
+            LIMIT ?
+        """
+        params = [bucket, bucket] + params + [int(limit)]
+    else:
+        sql = f"""
+            SELECT frame_number, epoch, timestamp, subpixel_row, height_cm,
+                   processing_time_sec, fps, image_path, carried_forward
+            FROM readings {where_sql}
+            ORDER BY frame_number
+            LIMIT ?
+        """
+        params = params + [int(limit)]
+
+    # Separate read-only connection so queries never block the writer
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+    finally:
+        conn.close()
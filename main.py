@@ -8,6 +8,7 @@ import cv2
 import time
 import shutil
 import os
+from contextlib import asynccontextmanager
 
 print("Imports done. Loading CameraService...")
 
@@ -15,7 +16,20 @@ from camera_service import CameraService
 
 print("CameraService imported. Creating app...")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Pick up config (and a session interrupted by a crash / power cut) from the last checkpoint.
+    # Done at startup rather than import so the uvicorn reloader process does not start capturing.
+    try:
+        camera_service.resume()
+    except Exception as e:
+        print(f"Could not restore checkpoint: {e}")
+    # Only the serving process compacts - a reloader parent must never delete sessions
+    camera_service.storage.start()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 print("FastAPI app created.")
 
@@ -64,11 +78,13 @@ def start(source: str = "0", calibration: float = 1.0, output_folder: str = "ses
     else:
         source_val = source  # video file path
 
-    camera_service.save_dir = output_folder
-    camera_service.target_fps = fps if fps > 0 else 30.0
-
     try:
-        camera_service.start(source=source_val, calibration=calibration)
+        # Session settings are applied by start() itself, only once it owns the lifecycle
+        started = camera_service.start(source=source_val, calibration=calibration,
+                                       output_folder=output_folder, target_fps=fps)
+        if not started:
+            return {"status": "already_running", "success": False,
+                    "message": "A session is already running"}
         return {"status": "started", "success": True, "fps": camera_service.target_fps}
     except Exception as e:
         return {"status": "error", "success": False, "message": str(e)}
@@ -81,23 +97,92 @@ def stop():
 
 
 @app.post("/set_zero")
-def set_zero():
-    camera_service.set_reference()
-    return {"status": "reference_set"}
+def set_zero(interface: int = None):
+    camera_service.set_reference(interface)
+    return {"status": "reference_set", "interface": interface}
 
 
 @app.post("/set_fps")
 def set_fps(value: float = 30.0):
     """Change target FPS on-the-fly while running"""
-    camera_service.target_fps = value if value > 0 else 30.0
+    camera_service.set_target_fps(value)
     return {"status": "fps_set", "fps": camera_service.target_fps}
 
 
 @app.post("/set_calibration")
-def set_calibration(value: float = 1.0):
-    """Change calibration factor on-the-fly"""
-    camera_service.set_calibration(value)
-    return {"status": "calibration_set", "value": value}
+def set_calibration(value: float = 1.0, interface: int = None):
+    """Change calibration factor on-the-fly (optionally for one interface)"""
+    camera_service.set_calibration(value, interface)
+    return {"status": "calibration_set", "value": value, "interface": interface}
+
+
+@app.get("/detector")
+def get_detector():
+    """Get current detector backend and parameters"""
+    return camera_service.get_detector_settings()
+
+
+@app.post("/set_detector")
+def set_detector(backend: str = None, num_eigenvecs: int = None, sigma: float = None,
+                 radius: float = None, max_dim: int = None):
+    """Switch detector backend and/or its parameters on-the-fly"""
+    try:
+        camera_service.set_detector(
+            backend, num_eigenvecs=num_eigenvecs, sigma=sigma, radius=radius, max_dim=max_dim
+        )
+        return {"status": "detector_set", **camera_service.get_detector_settings()}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@app.post("/set_shadow")
+def set_shadow(enabled: bool = True, backend: str = "sobel", sample_every: int = 10,
+               num_eigenvecs: int = None, sigma: float = None,
+               radius: float = None, max_dim: int = None):
+    """Run a candidate backend on sampled frames alongside the primary (A/B shadow mode)"""
+    try:
+        camera_service.set_shadow(
+            enabled, backend, sample_every,
+            num_eigenvecs=num_eigenvecs, sigma=sigma, radius=radius, max_dim=max_dim
+        )
+        return {"status": "shadow_set", **camera_service.get_shadow_stats()}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@app.get("/shadow_stats")
+def get_shadow_stats():
+    """Latency and level disagreement of the shadow backend against the primary"""
+    return camera_service.get_shadow_stats()
+
+
+@app.post("/set_analyzer_mode")
+def set_analyzer_mode(mode: str = "profile", strips: int = None, degree: int = None):
+    """Switch level estimation: 'profile' (row average) or 'columns' (tilt-robust fit)"""
+    try:
+        camera_service.set_analyzer_mode(mode, strips, degree)
+        return {"status": "analyzer_mode_set", **camera_service.get_analyzer_settings()}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@app.get("/analyzer_mode")
+def get_analyzer_mode():
+    """Get current level estimation settings"""
+    return camera_service.get_analyzer_settings()
+
+
+@app.post("/set_interfaces")
+def set_interfaces(count: int = 1, prominence: float = None, min_separation: int = None):
+    """Set how many interfaces to detect and track from one edge map"""
+    camera_service.set_interfaces(count, prominence, min_separation)
+    return {"status": "interfaces_set", **camera_service.get_interface_settings()}
+
+
+@app.get("/interfaces")
+def get_interfaces():
+    """Get multi-interface settings and the latest per-interface levels"""
+    return {**camera_service.get_interface_settings(), "levels": camera_service.get_stats()["interfaces"]}
 
 
 @app.post("/set_auto_lighting")
@@ -117,11 +202,65 @@ def get_auto_lighting():
     return camera_service.get_auto_lighting_settings()
 
 
+@app.post("/set_motion_gate")
+def set_motion_gate(enabled: bool = True, threshold: float = None, max_carry_forward: int = None):
+    """Enable/disable skipping detection when the ROI has not changed"""
+    camera_service.set_motion_gate(enabled, threshold, max_carry_forward)
+    return {"status": "motion_gate_set", **camera_service.get_motion_gate_settings()}
+
+
+@app.get("/motion_gate")
+def get_motion_gate():
+    """Get current motion gate settings"""
+    return camera_service.get_motion_gate_settings()
+
+
 @app.get("/level")
 def get_level():
     return camera_service.get_stats()
 
 
+@app.get("/history")
+def get_history(start: float = None, end: float = None,
+                start_frame: int = None, end_frame: int = None,
+                every: int = 1, bucket: float = None, agg: str = "avg",
+                limit: int = 10000, output_folder: str = None):
+    """
+    Query stored readings by time range (epoch seconds) or frame range.
+    'every' keeps every Nth frame, 'bucket' aggregates into N-second buckets.
+    """
+    try:
+        rows = camera_service.get_history(
+            output_folder=output_folder,
+            start=start, end=end,
+            start_frame=start_frame, end_frame=end_frame,
+            every=every, bucket=bucket, agg=agg, limit=limit
+        )
+        return {"success": True, "count": len(rows), "rows": rows}
+    except Exception as e:
+        return {"success": False, "message": str(e)}
+
+
+@app.get("/storage")
+def get_storage():
+    """Disk usage per session, write rate and compaction stats"""
+    return camera_service.get_storage_usage()
+
+
+@app.post("/set_storage_budget")
+def set_storage_budget(session_mb: float = None, total_mb: float = None, keep_every: int = None):
+    """Set per-session and total disk budgets (MB) and the thinning step"""
+    camera_service.set_storage_budget(session_mb, total_mb, keep_every)
+    return {"status": "storage_budget_set", **camera_service.storage.get_settings()}
+
+
+@app.post("/compact")
+def compact():
+    """Run a storage compaction pass now (in the background)"""
+    camera_service.storage.compact_now()
+    return {"status": "compaction_started"}
+
+
 # ======================================================
 # ROI (Region of Interest) ENDPOINTS
 # ======================================================
@@ -183,6 +322,19 @@ def get_roi():
     }
 
 
+@app.post("/set_auto_roi")
+def set_auto_roi(enabled: bool = True):
+    """Enable/disable automatic ROI proposal and tracking inside the ROI"""
+    camera_service.set_auto_roi(enabled)
+    return {"status": "auto_roi_set", **camera_service.get_auto_roi()}
+
+
+@app.get("/auto_roi")
+def get_auto_roi():
+    """Get auto ROI state and the crop currently being processed"""
+    return camera_service.get_auto_roi()
+
+
 def generate_frames():
     while True:
         frame = camera_service.get_frame()
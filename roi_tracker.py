@@ -0,0 +1,268 @@
+import cv2
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+
+
+class AutoROI:
+    """
+    Proposes a tight vessel / level ROI from the first few frames and tracks it.
+
+    Vessel walls come from vertical-edge energy and column variance of the
+    averaged warm-up frames; the vertical band is kept around the detected
+    meniscus. Camera shifts are followed on the wall profile only, so the
+    moving liquid is never mistaken for camera motion. Cropped detections are
+    checked against detections on the full outer region (periodically, and
+    whenever the level jumps); repeated disagreement re-runs the proposal and
+    finally falls back to the outer region. The outer bound (user ROI or full
+    frame) is never exceeded.
+    """
+
+    def __init__(self, warmup_frames=5, band_fraction=0.3, min_band=32,
+                 edge_margin=0.2, track_dim=128, max_shift=0.1, max_step=8.0,
+                 verify_every=30, max_disagree=3):
+        """
+        warmup_frames : frames averaged before proposing the ROI
+        band_fraction : nominal band height as a fraction of the outer height
+        min_band      : minimum band height in pixels
+        edge_margin   : widen the band when the meniscus is this close to its edge
+        track_dim     : width of the wall profile used for shift tracking
+        max_shift     : largest accepted camera shift, as a fraction of the outer width
+        max_step      : row change (pixels) beyond which a cropped detection is re-checked
+        verify_every  : detect on the full outer region every Nth frame
+        max_disagree  : disagreements in a row before the proposal is redone
+        """
+        self.warmup_frames = warmup_frames
+        self.band_fraction = band_fraction
+        self.min_band = min_band
+        self.edge_margin = edge_margin
+        self.track_dim = track_dim
+        self.max_shift = max_shift
+        self.max_step = max_step
+        self.verify_every = verify_every
+        self.max_disagree = max_disagree
+        self._outer = None
+        self.reset()
+
+    def reset(self):
+        """Forget the proposal - the next frames are used to propose a new one"""
+        self._failed_proposals = 0
+        self._fallback = False   # crop kept disagreeing - stay on the outer region
+        self._clear_proposal()
+
+    def _clear_proposal(self):
+        self._warmup = []
+        self._columns = None     # (x1, x2) relative to the outer bound
+        self._center = None      # meniscus row (absolute frame coordinates)
+        self._band = None        # current band height
+        self._nominal_band = None
+        self._template = None    # wall profile from proposal time
+        self._shift = 0.0        # horizontal camera shift (pixels)
+        self._frames = 0
+        self._reference = None   # last trusted row
+        self._crop_row = None    # last row detected inside the crop
+        self._disagree = 0
+        self.crop = None
+
+    @property
+    def ready(self):
+        return self._columns is not None
+
+    # ======================================================
+    # PER-FRAME UPDATE
+    # ======================================================
+    def update(self, frame, outer):
+        """Return the crop (x1, y1, x2, y2) to process for this frame"""
+        if outer != self._outer:
+            self._outer = outer
+            self.reset()
+
+        ox1, oy1, ox2, oy2 = outer
+        if self._fallback:
+            self.crop = outer
+            return outer
+
+        gray = self._gray(frame[oy1:oy2, ox1:ox2])
+
+        if not self.ready:
+            self._warmup.append(gray.astype(np.float32))
+            if len(self._warmup) < self.warmup_frames:
+                self.crop = outer
+                return outer
+            self._propose(np.mean(self._warmup, axis=0))
+            self._warmup = []
+            self._template = self._wall_profile(gray)
+        else:
+            self._track(gray)
+
+        # Regular full-region detections keep the crop honest
+        self._frames += 1
+        if self._reference is None or self._frames % self.verify_every == 0:
+            self.crop = outer
+        else:
+            self.crop = self._compute_crop()
+        return self.crop
+
+    def observe(self, row, narrow=True):
+        """
+        Feed back the detected meniscus row (absolute) for the current crop.
+
+        Returns False when a cropped detection disagrees with the last trusted
+        level; self.crop is then the outer region, which the caller should
+        detect on and observe() again. narrow=False keeps the band height
+        (several interfaces must stay inside it).
+        """
+        if self.crop is None:
+            return True
+
+        if self.crop == self._outer:
+            self._observe_full(row)
+            return True
+
+        if self._reference is not None and abs(row - self._reference) > self.max_step:
+            self._crop_row = row
+            self.crop = self._outer
+            return False
+
+        self._reference = row
+        self._crop_row = row
+        self._disagree = 0
+        if narrow:
+            self._follow(row)
+        return True
+
+    def _observe_full(self, row):
+        """A detection on the whole outer region - the reference the crop is checked against"""
+        self._reference = row
+        crop_row, self._crop_row = self._crop_row, None
+        if not self.ready:
+            return
+
+        if crop_row is not None and abs(row - crop_row) > self.max_step:
+            # The crop found something else: open the band around the real level
+            self._disagree += 1
+            self._center = row
+            self._band = self._outer[3] - self._outer[1]
+            if self._disagree >= self.max_disagree:
+                self._failed_proposals += 1
+                if self._failed_proposals >= 2:
+                    print("Auto ROI disagrees with the full ROI - using the full ROI")
+                    self._fallback = True
+                else:
+                    print("Auto ROI disagrees with the full ROI - proposing again")
+                self._clear_proposal()
+                self._reference = row
+                return
+        elif abs(row - self._center) > 0.25 * self._band:
+            self._center = row
+
+    def _follow(self, row):
+        """Re-centre the band on a trusted cropped detection"""
+        _, y1, _, y2 = self.crop
+        band = y2 - y1
+        oy1, oy2 = self._outer[1], self._outer[3]
+
+        # Only crop edges inside the outer bound count - the level cannot leave through those
+        near_top = y1 > oy1 and row - y1 < self.edge_margin * band
+        near_bottom = y2 < oy2 and y2 - row < self.edge_margin * band
+        near_edge = near_top or near_bottom
+        if near_edge:
+            # Level is running out of the band (or detection lost) - open it up
+            self._band = min(oy2 - oy1, self._band * 1.5)
+            self._center = row
+        else:
+            self._band = max(self._nominal_band, self._band * 0.9)
+            # Hysteresis keeps the crop (and the motion gate signature) stable
+            if abs(row - self._center) > 0.25 * band:
+                self._center = row
+
+    # ======================================================
+    # PROPOSAL
+    # ======================================================
+    def _propose(self, mean_gray):
+        h, w = mean_gray.shape
+
+        # Vessel walls: strong vertical edges; vessel interior: high column variance
+        gx = np.abs(cv2.Sobel(mean_gray, cv2.CV_32F, 1, 0, ksize=3))
+        wall_energy = gaussian_filter1d(gx.mean(axis=0), 2.0)
+        col_var = gaussian_filter1d(mean_gray.var(axis=0), 2.0)
+        score = self._normalize(wall_energy) + self._normalize(col_var)
+
+        cols = np.flatnonzero(score > 0.5 * score.max()) if score.max() > 0 else []
+        if len(cols) and cols[-1] - cols[0] >= 0.1 * w:
+            pad = max(2, int(0.05 * w))
+            self._columns = (int(max(0, cols[0] - pad)), int(min(w, cols[-1] + pad + 1)))
+        else:
+            self._columns = (0, w)
+
+        # Start with the full height around the warm-up level; the band shrinks as detections agree
+        self._center = self._reference if self._reference is not None else self._outer[1] + h / 2.0
+        self._band = h
+        self._nominal_band = min(h, max(self.min_band, int(self.band_fraction * h)))
+        print(f"Auto ROI proposed: columns {self._columns}")
+
+    # ======================================================
+    # TRACKING
+    # ======================================================
+    def _track(self, gray):
+        """
+        Follow horizontal camera shifts by correlating the wall profile.
+        Vertical shifts are not tracked - the liquid itself moves vertically,
+        and the band already follows the detected level.
+        """
+        current = self._wall_profile(gray)
+        if current.shape != self._template.shape:
+            return
+
+        n = len(current)
+        scale = n / gray.shape[1]
+        limit = max(1, int(self.max_shift * n))
+        lags = np.arange(-limit, limit + 1)
+        scores = np.array([
+            np.dot(self._template[max(0, -k):n - max(0, k)], current[max(0, k):n - max(0, -k)])
+            for k in lags
+        ]) / n
+
+        best = int(np.argmax(scores))
+        # Weak correlation or a peak at the search limit is not a trustworthy shift
+        if scores[best] < 0.5 or best in (0, len(lags) - 1):
+            return
+        self._shift = lags[best] / scale
+
+    def _wall_profile(self, gray):
+        """Zero-mean, unit-variance column profile of vertical-edge energy"""
+        h, w = gray.shape
+        scale = min(1.0, self.track_dim / w)
+        size = (max(8, int(w * scale)), max(8, int(h * scale)))
+        thumb = cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        gx = np.abs(cv2.Sobel(thumb, cv2.CV_32F, 1, 0, ksize=3))
+        profile = gaussian_filter1d(gx.mean(axis=0), 1.0)
+        std = profile.std()
+        return (profile - profile.mean()) / std if std > 0 else np.zeros_like(profile)
+
+    # ======================================================
+    # HELPERS
+    # ======================================================
+    def _compute_crop(self):
+        ox1, oy1, ox2, oy2 = self._outer
+        dx = int(round(self._shift))
+
+        x1 = min(max(ox1, ox1 + self._columns[0] + dx), ox2 - 1)
+        x2 = max(min(ox2, ox1 + self._columns[1] + dx), x1 + 1)
+
+        half = self._band / 2.0
+        y1 = int(max(oy1, self._center - half))
+        y2 = int(min(oy2, self._center + half))
+        if y2 - y1 < self.min_band:
+            y1 = max(oy1, min(y1, oy2 - self.min_band))
+            y2 = min(oy2, y1 + self.min_band)
+
+        return (x1, y1, x2, y2)
+
+    @staticmethod
+    def _gray(img):
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+    @staticmethod
+    def _normalize(v):
+        rng = v.max() - v.min()
+        return (v - v.min()) / rng if rng > 0 else np.zeros_like(v)
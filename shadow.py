@@ -0,0 +1,92 @@
+import queue
+import threading
+import collections
+
+import numpy as np
+
+
+class ShadowRunner:
+    """
+    Runs a candidate detector on a sampled subset of frames, off the hot path.
+
+    Frames are handed over through a single-slot queue: when the candidate
+    is still busy the sample is dropped, so the primary loop never waits.
+    Latency and level disagreement against the primary are kept over the
+    last `window` samples.
+    """
+
+    def __init__(self, detector, estimate_row, sample_every=10, window=500):
+        """
+        detector     : candidate EdgeDetector
+        estimate_row : callable edge map -> row, same analysis as the primary
+        sample_every : offer every Nth processed frame
+        """
+        self.detector = detector
+        self.estimate_row = estimate_row
+        self.sample_every = max(1, int(sample_every))
+
+        self.samples = 0
+        self.skipped = 0
+        self._primary_times = collections.deque(maxlen=window)
+        self._shadow_times = collections.deque(maxlen=window)
+        self._disagreement = collections.deque(maxlen=window)
+        self._stats_lock = threading.Lock()
+
+        self._queue = queue.Queue(maxsize=1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def offer(self, frame_number, img, y_offset, primary_row, primary_time):
+        """Hand a detected frame to the shadow backend if it is sampled and idle"""
+        if frame_number % self.sample_every != 0:
+            return
+        try:
+            self._queue.put_nowait((img, y_offset, primary_row, primary_time))
+        except queue.Full:
+            self.skipped += 1
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                img, y_offset, primary_row, primary_time = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            try:
+                result = self.detector.detect_timed(img)
+                row = self.estimate_row(result["edge"]) + y_offset
+            except Exception as e:
+                print(f"Shadow detector error: {e}")
+                continue
+
+            with self._stats_lock:
+                self.samples += 1
+                self._primary_times.append(primary_time)
+                self._shadow_times.append(result["time"])
+                self._disagreement.append(abs(row - primary_row))
+
+    def get_stats(self):
+        with self._stats_lock:
+            primary = np.array(self._primary_times)
+            shadow = np.array(self._shadow_times)
+            diff = np.array(self._disagreement)
+
+        if len(diff) == 0:
+            return {"samples": 0, "skipped": self.skipped}
+
+        return {
+            "samples": self.samples,
+            "skipped": self.skipped,
+            "primary_latency_mean": float(primary.mean()),
+            "primary_latency_p95": float(np.percentile(primary, 95)),
+            "shadow_latency_mean": float(shadow.mean()),
+            "shadow_latency_p95": float(np.percentile(shadow, 95)),
+            "speedup": float(primary.mean() / (shadow.mean() + 1e-9)),
+            "disagreement_rows_mean": float(diff.mean()),
+            "disagreement_rows_p95": float(np.percentile(diff, 95)),
+            "disagreement_rows_max": float(diff.max()),
+        }
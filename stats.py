@@ -0,0 +1,65 @@
+import collections
+
+
+# Immutable view of the live measurement, replaced as a whole after every frame.
+# Readers take one reference and always see a consistent set of values.
+StatsSnapshot = collections.namedtuple("StatsSnapshot", [
+    "level",            # height (cm) relative to the zero reference
+    "fps",              # processed frames per second
+    "processing_time",  # seconds spent on the last frame
+    "latency",          # mean capture -> result delay (seconds)
+    "frame_count",
+    "carried_frames",
+    "interfaces",       # tuple of {"id", "row", "height"} dicts
+    "tilt",
+    "confidence",
+    "fit_residual",
+])
+
+EMPTY_STATS = StatsSnapshot(
+    level=0.0, fps=0.0, processing_time=0.0, latency=0.0, frame_count=0,
+    carried_frames=0, interfaces=(), tilt=None, confidence=None, fit_residual=None
+)
+
+
+class RateEstimator:
+    """
+    Event rate and mean latency over the last `size` events.
+
+    Fixed-size ring buffer with a running latency sum, so add() and the
+    getters are O(1) regardless of the frame rate.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self._times = [0.0] * self.size
+        self._latencies = [0.0] * self.size
+        self._idx = 0
+        self._count = 0
+        self._latency_sum = 0.0
+
+    def add(self, timestamp, latency=0.0):
+        i = self._idx
+        if self._count == self.size:
+            self._latency_sum -= self._latencies[i]
+        else:
+            self._count += 1
+        self._times[i] = timestamp
+        self._latencies[i] = latency
+        self._latency_sum += latency
+        self._idx = (i + 1) % self.size
+
+    def rate(self):
+        """Events per second between the oldest and newest event in the buffer"""
+        if self._count < 2:
+            return 0.0
+        newest = self._times[self._idx - 1]
+        oldest = self._times[self._idx if self._count == self.size else 0]
+        span = newest - oldest
+        return (self._count - 1) / span if span > 0 else 0.0
+
+    def mean_latency(self):
+        return self._latency_sum / self._count if self._count else 0.0
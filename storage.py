@@ -0,0 +1,322 @@
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import collections
+
+import cv2
+
+from history_store import history_path
+
+
+IMAGE_DIR = "Processed_Images"
+FRAME_RE = re.compile(r"^frame_(\d+)_.*\.png$")
+MB = 1024 * 1024
+
+
+class StorageManager:
+    """
+    Keeps session output folders within a disk budget.
+
+    A low-priority background thread periodically:
+      * deletes the oldest sessions while all sessions exceed total_budget
+      * thins edge images of sessions over session_budget, oldest first,
+        keeping every Nth stored image, frames where the level moved and
+        images that carried-forward readings point at
+      * recompresses the images it keeps at maximum PNG compression
+
+    The active session is never deleted and its newest images (younger than
+    min_age) are never thinned. A history database is only removed together
+    with its whole session. Nothing here shares a lock with the save loop -
+    it only bumps a byte counter.
+    """
+
+    def __init__(self, root=".", session_budget_mb=1024, total_budget_mb=4096,
+                 keep_every=10, level_change_rows=2.0, min_age=60.0, interval=60.0):
+        """
+        root              : folder scanned for session folders (those with Processed_Images)
+        session_budget_mb : byte budget per session folder
+        total_budget_mb   : byte budget across all session folders
+        keep_every        : when thinning, keep every Nth stored image
+        level_change_rows : also keep frames whose row moved at least this much
+        min_age           : seconds before a new image may be compacted
+        interval          : seconds between background compaction passes
+        """
+        self.root = root
+        self.session_budget = int(session_budget_mb * MB)
+        self.total_budget = int(total_budget_mb * MB)
+        self.keep_every = keep_every
+        self.level_change_rows = level_change_rows
+        self.min_age = min_age
+        self.interval = interval
+        self.throttle = 0.005  # seconds slept between file operations
+
+        self.active_dir = None
+        self._sessions = set()
+        self._recompressed = set()
+        self._kept = set()  # every-Nth survivors - later passes never thin them
+
+        # Written by the save loop (counter only) and sampled by the background thread
+        self.bytes_written = 0
+        self.images_written = 0
+        self._rate_samples = collections.deque(maxlen=11)
+
+        self.deleted_files = 0
+        self.deleted_sessions = 0
+        self.reclaimed_bytes = 0
+        self._usage = {}
+        self._last_pass = None
+
+        self._wake = threading.Event()
+        self._thread = None
+
+    # ======================================================
+    # CONTROL
+    # ======================================================
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def set_active(self, save_dir):
+        """Register the current session - it is thinned but never deleted"""
+        self.active_dir = os.path.abspath(save_dir)
+        self._sessions.add(self.active_dir)
+
+    def set_budget(self, session_budget_mb=None, total_budget_mb=None, keep_every=None):
+        if session_budget_mb is not None:
+            self.session_budget = int(max(1, session_budget_mb) * MB)
+        if total_budget_mb is not None:
+            self.total_budget = int(max(1, total_budget_mb) * MB)
+        if keep_every is not None:
+            self.keep_every = max(1, int(keep_every))
+        print(f"Storage budget: session {round(self.session_budget / MB, 2)} MB, "
+              f"total {round(self.total_budget / MB, 2)} MB, keep every {self.keep_every}")
+
+    def get_settings(self):
+        return {
+            "session_budget_mb": round(self.session_budget / MB, 2),
+            "total_budget_mb": round(self.total_budget / MB, 2),
+            "keep_every": self.keep_every,
+            "level_change_rows": self.level_change_rows,
+            "min_age": self.min_age,
+            "interval": self.interval
+        }
+
+    def compact_now(self):
+        """Ask the background thread for an immediate pass"""
+        self._wake.set()
+
+    def record_write(self, nbytes):
+        """Hot path (save loop): just count"""
+        self.bytes_written += nbytes
+        self.images_written += 1
+
+    # ======================================================
+    # REPORTING
+    # ======================================================
+    def usage(self):
+        """Disk usage from the last pass plus the live write rate"""
+        rate = 0.0
+        if len(self._rate_samples) >= 2:
+            (t0, b0), (t1, b1) = self._rate_samples[0], self._rate_samples[-1]
+            rate = (b1 - b0) / (t1 - t0) if t1 > t0 else 0.0
+
+        disk = shutil.disk_usage(self.root)
+        return {
+            **self._usage,
+            "disk_free_bytes": disk.free,
+            "disk_total_bytes": disk.total,
+            "write_rate_bytes_per_sec": rate,
+            "bytes_written": self.bytes_written,
+            "images_written": self.images_written,
+            "deleted_files": self.deleted_files,
+            "deleted_sessions": self.deleted_sessions,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "last_pass": self._last_pass,
+            **self.get_settings()
+        }
+
+    # ======================================================
+    # BACKGROUND LOOP
+    # ======================================================
+    def _loop(self):
+        # Linux supports per-thread nice values; elsewhere just rely on throttling
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+        next_pass = time.time()
+        while True:
+            self._rate_samples.append((time.time(), self.bytes_written))
+            if self._wake.wait(timeout=1.0):
+                self._wake.clear()
+                next_pass = 0.0
+            if time.time() < next_pass:
+                continue
+            try:
+                self._compact_pass()
+            except Exception as e:
+                print(f"Storage compaction error: {e}")
+            next_pass = time.time() + self.interval
+
+    def _compact_pass(self):
+        sessions = {s: _dir_size(s) for s in self._discover_sessions()}
+
+        # 1) Over the total budget: remove whole sessions, oldest first
+        total = sum(sessions.values())
+        for path in sorted(sessions, key=_session_mtime):
+            if total <= self.total_budget:
+                break
+            if path == self.active_dir:
+                continue
+            print(f"Storage budget exceeded - deleting session {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            self._sessions.discard(path)
+            self.deleted_sessions += 1
+            self.reclaimed_bytes += sessions[path]
+            total -= sessions.pop(path)
+
+        # 2) Sessions over their own budget: thin and recompress edge images
+        for path, size in list(sessions.items()):
+            if size > self.session_budget:
+                sessions[path] = self._compact_session(path, size)
+
+        self._usage = {
+            "sessions": {p: s for p, s in sorted(sessions.items())},
+            "total_bytes": sum(sessions.values()),
+        }
+        self._last_pass = time.time()
+
+    def _discover_sessions(self):
+        found = set()
+        for s in self._sessions:
+            if os.path.isdir(os.path.join(s, IMAGE_DIR)):
+                found.add(s)
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_dir() and os.path.isdir(os.path.join(entry.path, IMAGE_DIR)):
+                    found.add(os.path.abspath(entry.path))
+        return found
+
+    def _compact_session(self, path, size):
+        img_dir = os.path.join(path, IMAGE_DIR)
+        cutoff = time.time() - self.min_age
+
+        frames = []
+        with os.scandir(img_dir) as it:
+            for entry in it:
+                m = FRAME_RE.match(entry.name)
+                if m is None:
+                    continue
+                st = entry.stat()
+                if st.st_mtime < cutoff:
+                    frames.append((int(m.group(1)), entry.path, st.st_size))
+        frames.sort()
+
+        keep = self._level_change_frames(path)
+        referenced = self._carried_images(path)
+
+        # Thin oldest first until within budget. With the motion gate only detected
+        # frames have images, so "every Nth" counts stored images, not frame numbers.
+        candidates = [f for f in frames if f[1] not in self._kept]
+        for idx, (number, file_path, file_size) in enumerate(candidates):
+            if size <= self.session_budget:
+                break
+            if idx % self.keep_every == 0:
+                self._kept.add(file_path)
+                continue
+            if number in keep or os.path.basename(file_path) in referenced:
+                continue
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            size -= file_size
+            self.deleted_files += 1
+            self.reclaimed_bytes += file_size
+            time.sleep(self.throttle)
+
+        # Still over budget: squeeze the images that are kept
+        if size > self.session_budget:
+            for number, file_path, file_size in frames:
+                if file_path in self._recompressed or not os.path.exists(file_path):
+                    continue
+                size -= self._recompress(file_path, file_size)
+                time.sleep(self.throttle)
+
+        return size
+
+    def _level_change_frames(self, path):
+        """Frame numbers where the detected row moved (from the session history)"""
+        rows = _query_history_db(path, """
+            SELECT frame_number FROM (
+                SELECT frame_number,
+                       ABS(subpixel_row - LAG(subpixel_row) OVER (ORDER BY frame_number)) AS step
+                FROM readings
+            ) WHERE step >= ?
+        """, (self.level_change_rows,))
+
+        # Keep the frame before the change too, so both levels stay visible
+        keep = set()
+        for (n,) in rows:
+            keep.update((n - 1, n))
+        return keep
+
+    def _carried_images(self, path):
+        """File names of images that carried-forward readings point at"""
+        rows = _query_history_db(path, """
+            SELECT DISTINCT image_path FROM readings
+            WHERE carried_forward = 1 AND image_path IS NOT NULL
+        """)
+        return {os.path.basename(p) for (p,) in rows}
+
+    def _recompress(self, file_path, file_size):
+        img = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
+        self._recompressed.add(file_path)
+        if img is None:
+            return 0
+        ok, buf = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+        if not ok or len(buf) >= file_size:
+            return 0
+
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(tmp_path, file_path)
+        saved = file_size - len(buf)
+        self.reclaimed_bytes += saved
+        return saved
+
+
+def _query_history_db(path, sql, params=()):
+    """Read-only query on a session's history database ([] if missing or unreadable)"""
+    db = history_path(path)
+    if not os.path.exists(db):
+        return []
+    conn = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+    try:
+        return conn.execute(sql, params).fetchall()
+    except sqlite3.Error:
+        return []
+    finally:
+        conn.close()
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _session_mtime(path):
+    db = history_path(path)
+    return os.path.getmtime(db if os.path.exists(db) else path)